@@ -1,14 +1,17 @@
 import os
 import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from dotenv import load_dotenv
 from qiskit import *
-from qiskit.visualization import plot_histogram
 from qiskit_aer import *
-from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
 from qiskit_ibm_runtime import (SamplerV2 as Sampler)
 from qiskit.primitives import (BackendSamplerV2)
 from requests.packages import target
+from simulator_config import choose_simulator, build_simulator, build_noise_model, simulator_circuit
+from result_cache import ResultCache, cached_transpile, result_key
+from histogram import Histogram
 
 def initialise(n: int):
     '''
@@ -18,12 +21,12 @@ def initialise(n: int):
     '''
 
     # n-qubit quantum register
-    _qr = QuantumRegister(_num_qubits, "qubit")
+    qr = QuantumRegister(n, "qubit")
 
-    qc = QuantumCircuit(_qr)
+    qc = QuantumCircuit(qr)
 
     # equal superposition
-    qc.h(_qr)
+    qc.h(qr)
 
     qc.barrier()
 
@@ -47,7 +50,7 @@ def oracle_operator(n: int, targets: list[str]):
     :return: oracle circuit
     '''
     # generate circuit
-    oracle = QuantumCircuit(_qr, name='Oracle')
+    oracle = QuantumCircuit(QuantumRegister(n, "qubit"), name='Oracle')
 
     # loop over target states
     for target in targets:
@@ -73,11 +76,12 @@ def diffusion_operator(n: int):
     :return: diffusion operator circuit
     '''
 
-    diffusion = QuantumCircuit(_qr, name='Diffusion Operator')
+    qr = QuantumRegister(n, "qubit")
+    diffusion = QuantumCircuit(qr, name='Diffusion Operator')
 
     # Hadamard and X Gate all states
-    diffusion.h(_qr)
-    diffusion.x(_qr)
+    diffusion.h(qr)
+    diffusion.x(qr)
 
     # MCZ Operator to the target state (|11...1>)
     diffusion.h(n-1)
@@ -85,67 +89,218 @@ def diffusion_operator(n: int):
     diffusion.h(n-1)
 
     # Reverse Hadamard and X Gates
-    diffusion.x(_qr)
-    diffusion.h(_qr)
+    diffusion.x(qr)
+    diffusion.h(qr)
 
     return diffusion
 
-def grovers_circuit(n, targets):
+def grovers_circuit(n, targets, num_its: int | None = None):
     '''
     Circuit representing Grover's algorithm
     :param n: number of qubits
     :param targets: list of target states
+    :param num_its: number of Grover iterations. Default is the optimum for a single target, round(pi/4 * sqrt(2^n))
     :return: circuit containing Grover's algorithm
     '''
+    if num_its is None: num_its = round(np.pi * np.sqrt(2 ** n) * 0.25)
+
     grovers = initialise(n)
 
-    for _ in range(_num_its):
+    for _ in range(num_its):
         grovers.barrier()
         oracle = oracle_operator(n, targets)
-        grovers.append(oracle,_qr)
+        grovers.append(oracle, grovers.qubits)
         grovers.barrier()
         diff = diffusion_operator(n)
-        grovers.append(diff, _qr)
+        grovers.append(diff, grovers.qubits)
 
     cr = ClassicalRegister(n)
     grovers.measure_all()
     return grovers
 
-def run_grovers(n: int, targets: list[str], num_shots: int = 1000, on_hardware: bool = False):
+def run_grovers(n: int, targets: list[str], num_shots: int = 1000, on_hardware: bool = False, noise: bool | None = None,
+                cache: ResultCache | None = None):
     '''
     Function to run Grover's algorithm.
     :param n: number of wubits
     :param targets: list of target integers
-    :return: counts
+    :param noise: force the simulator noise model on or off. Default lets the simulator policy decide
+    :param cache: result cache to reuse transpiled circuits and samples from. Default runs everything afresh
+    :return: histogram of measured integers. Plot with counts.plot()
     '''
     # Generate Circuit
     grovers = grovers_circuit(n, targets)
 
     # Transpile
-    backend_target = backend.target
-    pm = generate_preset_pass_manager(target=backend_target, optimization_level=3)
-    qc_isa = pm.run(grovers)
+    qc_isa = cached_transpile(grovers, backend, optimization_level=3, cache=cache)
 
     if on_hardware:
-        # Run Algorithm on Hardware
-        sampler = Sampler(mode=backend)
-        pubs = [qc_isa]
-        job = sampler.run(pubs, shots=num_shots)
-        res = job.result()
+        options = {'on_hardware': True}
     else:
-        # Run sample on quantum simulator of backend
-        backend_sim = AerSimulator.from_backend(backend)
-        sampler_sim = BackendSamplerV2(backend=backend_sim)
-        job = sampler_sim.run([[qc_isa]], shots=num_shots)
-        res = job.result()
-
-    # get data in readable format
-    bitstrings = res[0].data.meas.get_counts()
-    counts = {int(bitstring, 2): count for bitstring, count in bitstrings.items()}
-    plot_histogram(counts)
+        # only choose settings here; building the simulator (and its noise model) is left to a cache miss
+        sim_config = choose_simulator(qc_isa, noise=noise)
+        print(sim_config)
+        options = {'noise': sim_config.noise, **sim_config.options}
+
+    # Reuse previous samples of the same circuit, backend and settings
+    key = result_key(qc_isa, backend, num_shots, options) if cache is not None else None
+    bits = cache.get_bits(key) if cache is not None else None
+
+    if bits is None:
+        if on_hardware:
+            # Run Algorithm on Hardware
+            sampler = Sampler(mode=backend)
+            pubs = [qc_isa]
+            job = sampler.run(pubs, shots=num_shots)
+            res = job.result()
+        else:
+            # Run sample on quantum simulator of backend
+            backend_sim = build_simulator(backend, sim_config)
+            sampler_sim = BackendSamplerV2(backend=backend_sim)
+            job = sampler_sim.run([[simulator_circuit(qc_isa, sim_config)]], shots=num_shots)
+            res = job.result()
+
+        bits = res[0].data.meas
+        if cache is not None: cache.put_bits(key, bits)
+
+    # tally measured integers
+    counts = Histogram.from_bits(bits)
 
     return counts
 
+def success_probability(counts: Histogram, targets: list[str]):
+    '''
+    Estimate the probability that Grover's algorithm measures one of the targets
+    :param counts: histogram returned by run_grovers
+    :param targets: list of target states, in little endian
+    :return: fraction of shots which found a target
+    '''
+    return counts.probability([int(target[::-1], 2) for target in targets])
+
+def partition_targets(n: int, k: int, targets: list[str]):
+    '''
+    Split a search over n qubits into 2^k searches over the lowest n-k qubits, with the top k qubits fixed
+    :param n: number of qubits
+    :param k: number of fixed (partition) qubits
+    :param targets: list of target states, in little endian
+    :return: list of sub-search targets for each partition, indexed by the value of the top k bits
+    '''
+    sub_n = n - k
+    partitions = []
+    for p in range(2 ** k):
+        prefix = format(p, f'0{k}b')[::-1]  # top k qubits, little endian
+        partitions.append([target[:sub_n] for target in targets if target[sub_n:] == prefix])
+    return partitions
+
+# backend noise models by simulation method, sent once to each worker process by init_partition_worker rather than with every partition
+_worker_noise_models = {}
+
+def init_partition_worker(noise_models: dict):
+    '''
+    Store the backend noise models in a partition worker process
+    :param noise_models: noise model for each simulation method run with noise
+    '''
+    global _worker_noise_models
+    _worker_noise_models = noise_models
+
+def sample_partition(qc_isa: QuantumCircuit, num_shots: int, options: dict, noise: bool):
+    '''
+    Sample one partition's circuit on a simulator built in the worker process
+    :param qc_isa: transpiled circuit, adapted by simulator_circuit
+    :param num_shots: number of shots
+    :param options: simulator options chosen by choose_simulator
+    :param noise: whether to apply the worker's noise model for this method
+    :return: measured bit array
+    '''
+    backend_sim = AerSimulator(noise_model=_worker_noise_models.get(options['method']) if noise else None, **options)
+    sampler_sim = BackendSamplerV2(backend=backend_sim)
+    job = sampler_sim.run([[qc_isa]], shots=num_shots)
+    return job.result()[0].data.meas
+
+def run_partitioned_grovers(n: int, targets: list[str], k: int, num_shots: int = 1000, on_hardware: bool = False,
+                            noise: bool | None = None, cache: ResultCache | None = None, max_workers: int | None = None,
+                            num_candidates: int = 1):
+    '''
+    Function to run Grover's algorithm as 2^k independent searches over n-k qubits.
+    Each partition fixes the top k bits, so its circuit needs only round(pi/4 * sqrt(2^(n-k))) iterations.
+    Simulated partitions run in a process pool, hardware partitions as one multi-PUB job.
+    The most frequent outcomes of each partition are verified classically against the oracle.
+    :param n: number of qubits
+    :param targets: list of target states, in little endian
+    :param k: number of top bits fixed per partition. Must leave at least 2 qubits to search
+    :param num_shots: number of shots per partition
+    :param noise: force the simulator noise model on or off. Default lets the simulator policy decide
+    :param cache: result cache to reuse transpiled circuits and samples from. Default runs everything afresh
+    :param max_workers: number of worker processes for simulation. Default is one per core
+    :param num_candidates: number of most frequent outcomes per partition to verify
+    :return found: sorted list of verified target integers
+    :return counts: histogram over all n bits, merging every partition
+    '''
+    sub_n = n - k
+    if k < 1 or sub_n < 2: raise ValueError('Partitioning must fix at least 1 bit and leave at least 2 qubits to search')
+
+    # Generate and transpile one circuit per partition
+    circuits = [grovers_circuit(sub_n, sub_targets) for sub_targets in partition_targets(n, k, targets)]
+    isa_circuits = [cached_transpile(qc, backend, optimization_level=3, cache=cache) for qc in circuits]
+
+    if on_hardware:
+        options = [{'on_hardware': True}] * len(isa_circuits)
+    else:
+        # share the cores between worker processes rather than letting each simulator claim them all
+        max_workers = max_workers or os.cpu_count() or 1
+        threads = max(1, (os.cpu_count() or 1) // max_workers)
+        configs = [choose_simulator(qc_isa, noise=noise, num_cores=threads) for qc_isa in isa_circuits]
+        options = [{'noise': config.noise, **config.options} for config in configs]
+
+        # partitions without a target have an empty oracle, so their settings can differ
+        for method in dict.fromkeys(config.method for config in configs):
+            partitions = [p for p, config in enumerate(configs) if config.method == method]
+            print(f'Partitions {partitions}, on {max_workers} worker processes with {threads} core(s) each:')
+            print(configs[partitions[0]])
+
+    # Reuse previous samples of the same circuits, backend and settings. Partitions without a target share
+    # one circuit, so the partition index is part of the key to keep their samples independent.
+    keys = [result_key(qc_isa, backend, num_shots, {**opts, 'partition': p}) if cache is not None else None
+            for p, (qc_isa, opts) in enumerate(zip(isa_circuits, options))]
+    bits = [cache.get_bits(key) if cache is not None else None for key in keys]
+    missing = [p for p, b in enumerate(bits) if b is None]
+
+    if missing:
+        if on_hardware:
+            # Run all partitions on hardware as a single job
+            sampler = Sampler(mode=backend)
+            pubs = [isa_circuits[p] for p in missing]
+            job = sampler.run(pubs, shots=num_shots)
+            sampled = [pub_res.data.meas for pub_res in job.result()]
+        else:
+            # Run partitions on simulators in parallel processes. Spawn rather than fork, since forking
+            # a process which has already run Aer can deadlock the workers.
+            noisy = {configs[p].method: configs[p] for p in missing if configs[p].noise}
+            noise_models = {method: build_noise_model(backend, config) for method, config in noisy.items()}
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=init_partition_worker, initargs=(noise_models,)) as pool:
+                sampled = list(pool.map(sample_partition, [simulator_circuit(isa_circuits[p], configs[p]) for p in missing],
+                                        [num_shots] * len(missing),
+                                        [configs[p].options for p in missing], [configs[p].noise for p in missing]))
+
+        for p, b in zip(missing, sampled):
+            bits[p] = b
+            if cache is not None: cache.put_bits(keys[p], b)
+
+    # Merge partitions: prefix each sub-search outcome with its fixed top bits
+    histograms = [Histogram.from_bits(b) for b in bits]
+    counts = Histogram(np.concatenate([(p << sub_n) + h.outcomes for p, h in enumerate(histograms)]),
+                       np.concatenate([h.counts for h in histograms]), n)
+
+    # Verify candidates classically against the oracle's targets
+    target_integers = {int(target[::-1], 2) for target in targets}
+    found = set()
+    for p, h in enumerate(histograms):
+        outcomes, _ = h.top_k(num_candidates)
+        found.update(c for c in ((p << sub_n) + int(o) for o in outcomes) if c in target_integers)
+
+    return sorted(found), counts
+
 
 if __name__ == '__main__':
     # Fetch API token and instance CRN. Stored locally in a .env file and not pushed, for obvious reasons.
@@ -177,13 +332,8 @@ if __name__ == '__main__':
     # binary representations of search values in little endian
     _targets: list[str] = [format(num, f'0{_num_qubits}b')[::-1] for num in _target_integers]
 
-    # number of iterations of the algorithm
-    _num_its: int = round(np.pi * np.sqrt(2 ** _num_qubits) * 0.25)
-
-    # n-qubit quantum register
-    _qr: QuantumRegister = QuantumRegister(_num_qubits, "qubit")
-
     counts = run_grovers(_num_qubits, _targets, num_shots=1000, on_hardware=False)
-    hist = plot_histogram(counts).savefig(f'GroversHistogram{_target_integers}.png')
+    print('Success probability:', success_probability(counts, _targets))
+    hist = counts.plot().savefig(f'GroversHistogram{_target_integers}.png')
 
 
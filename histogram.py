@@ -0,0 +1,135 @@
+import numpy as np
+from qiskit.primitives import BitArray
+
+BINCOUNT_MAX_BITS = 20  # widest register tallied with a dense np.bincount, wider ones use np.unique
+BINCOUNT_SHOTS_RATIO = 8  # the dense tally may be at most this many times longer than the number of shots
+
+
+class Histogram:
+    """
+    Integer indexed measurement histogram, built directly from sampler bit arrays.
+
+    Outcomes are stored as a sorted array of integers with a matching array of counts, so
+    post-processing never has to build or parse bitstrings.
+
+    Parameters
+    ----------
+    outcomes : np.ndarray, required. Sorted, unique measured integers.
+    counts : np.ndarray, required. Number of shots which gave each outcome.
+    num_bits : int, required. Number of measured bits.
+    """
+
+    def __init__(self, outcomes: np.ndarray, counts: np.ndarray, num_bits: int):
+        self.outcomes = outcomes
+        self.counts = counts
+        self.num_bits = num_bits
+
+    @classmethod
+    def from_bits(cls, bits: BitArray):
+        """
+        Tally the shots of a sampler bit array.
+
+        Parameters
+        ----------
+        bits : BitArray, required. Measured bits, e.g. ``res[0].data.meas``.
+
+        Returns
+        -------
+        Histogram. The measurement histogram.
+        """
+        # each shot is a row of big-endian bytes
+        rows = bits.array.reshape(-1, bits.array.shape[-1])
+
+        if bits.num_bits > 64:
+            # too wide for machine integers: deduplicate rows first, then convert only the unique ones
+            unique_rows, counts = np.unique(rows, axis=0, return_counts=True)
+            outcomes = np.array([int.from_bytes(row.tobytes(), 'big') for row in unique_rows], dtype=object)
+            return cls(outcomes, counts, bits.num_bits)
+
+        values = np.zeros(rows.shape[0], dtype=np.uint64)
+        for column in range(rows.shape[1]):
+            values = (values << np.uint64(8)) | rows[:, column].astype(np.uint64)
+
+        # a dense tally allocates 2^num_bits entries, so only use it when that is small next to the shot count
+        if bits.num_bits <= BINCOUNT_MAX_BITS and 2**bits.num_bits <= BINCOUNT_SHOTS_RATIO * rows.shape[0]:
+            tally = np.bincount(values.astype(np.intp), minlength=2**bits.num_bits)
+            outcomes = np.flatnonzero(tally)
+            counts = tally[outcomes]
+        else:
+            outcomes, counts = np.unique(values, return_counts=True)
+
+        return cls(outcomes, counts, bits.num_bits)
+
+    @classmethod
+    def empty(cls, num_bits: int):
+        """ Histogram with no shots """
+        return cls(np.array([], dtype=np.intp), np.array([], dtype=np.intp), num_bits)
+
+    @property
+    def shots(self):
+        """ Total number of shots """
+        return int(self.counts.sum())
+
+    def __len__(self):
+        return len(self.outcomes)
+
+    def top_k(self, k: int):
+        """
+        Most frequent outcomes.
+
+        Parameters
+        ----------
+        k : int, required. Number of outcomes to return.
+
+        Returns
+        -------
+        outcomes : np.ndarray. The k most frequent outcomes, most frequent first.
+        counts : np.ndarray. Their counts.
+        """
+        k = min(k, len(self))
+        if k == 0:
+            return self.outcomes[:0], self.counts[:0]
+        top = np.argpartition(self.counts, -k)[-k:]
+        top = top[np.argsort(self.counts[top])[::-1]]
+        return self.outcomes[top], self.counts[top]
+
+    def probability(self, values):
+        """
+        Estimated probability of measuring any of the given outcomes.
+
+        Parameters
+        ----------
+        values : iterable of int, required. Outcomes to include.
+
+        Returns
+        -------
+        float. Fraction of shots which gave one of the outcomes.
+        """
+        if self.shots == 0:
+            return 0.0
+        mask = np.isin(self.outcomes, np.asarray(list(values), dtype=self.outcomes.dtype))
+        return float(self.counts[mask].sum() / self.shots)
+
+    def to_dict(self):
+        """ Counts as a dictionary keyed by integer outcome """
+        return dict(zip(self.outcomes.tolist(), self.counts.tolist()))
+
+    def plot(self, top_k: int | None = None, **kwargs):
+        """
+        Plot the histogram. Deferred until asked for, as drawing is far slower than counting.
+
+        Parameters
+        ----------
+        top_k : int, optional. Only plot the k most frequent outcomes.
+        kwargs : optional. Passed on to ``qiskit.visualization.plot_histogram``.
+
+        Returns
+        -------
+        matplotlib.figure.Figure. The histogram figure.
+        """
+        from qiskit.visualization import plot_histogram
+
+        if top_k is None:
+            return plot_histogram(self.to_dict(), **kwargs)
+        outcomes, counts = self.top_k(top_k)
+        return plot_histogram(dict(zip(outcomes.tolist(), counts.tolist())), **kwargs)
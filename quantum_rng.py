@@ -4,9 +4,9 @@ from dotenv import load_dotenv
 from qiskit import *
 from qiskit_aer import *
 from qiskit_ibm_runtime import QiskitRuntimeService
-from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
 from qiskit_ibm_runtime import SamplerV2 as Sampler
 import math
+from result_cache import ResultCache, cached_transpile
 
 def ibmq_connect_least_busy(token, instance):
     '''
@@ -83,21 +83,20 @@ def fast_dice_roller(min_inclusive, max_exclusive, bitstream, num_ints):
 
     return integers
 
-def generate_bitstring(n, num_shots):
+def generate_bitstring(n, num_shots, cache: ResultCache | None = None):
     '''
     Generate bitstring of length n using IBM quantum service.
     :param n: number of bits (or qubits)
     :param num_shots: number of shots to generate
+    :param cache: result cache to reuse the transpiled circuit from. Samples are never cached, so every call draws fresh bits
     :return bitstring: bitstring of length n
     '''
     # Create circuit
     qr, cr, qc = generate_nbit_circuit(n)
 
     # Transpile
-    target = backend.target
     if n > backend.num_qubits: raise 'Not enough qubits to generate that large a number'
-    pm = generate_preset_pass_manager(target=target, optimization_level=3)
-    qc_isa = pm.run(qc)
+    qc_isa = cached_transpile(qc, backend, optimization_level=3, cache=cache)
 
     # Run sample on hardware
     sampler = Sampler(mode=backend)
@@ -105,20 +104,18 @@ def generate_bitstring(n, num_shots):
     job = sampler.run(pubs, shots=num_shots)
     res = job.result()
 
-    # return bitstring
-    bitstrings = res[0].data.meas.get_counts()
-    result = []
-    for key, count in bitstrings.items():
-        result.extend([key] * count)
-    bitstream = [int(bit) for bit in ''.join(result)]
+    # return bitstring, unpacked straight from the sampled bytes in shot order
+    bits = res[0].data.meas
+    bitstream = np.unpackbits(bits.array, axis=-1)[:, -bits.num_bits:].ravel().tolist()
     return bitstream
 
-def quantum_random_int(min_val, max_val, num_its=1):
+def quantum_random_int(min_val, max_val, num_its=1, cache: ResultCache | None = None):
     '''
     Generate random number in range
     :param min_val: minimal range value
     :param max_val: maximal range value, not inclusive
     :param num_its: number of random numbers to generate
+    :param cache: result cache to reuse the transpiled circuit from
     :return:
     '''
     diff = 0
@@ -136,7 +133,7 @@ def quantum_random_int(min_val, max_val, num_its=1):
     num_shots = math.ceil(total_bits/available_qubits) # how many times we need to sample from the register
     num_qubits = int(total_bits / num_shots) # more efficient use of the quantum register
 
-    bitstream = generate_bitstring(num_qubits, num_shots) # run quantum circuit to get list of bits
+    bitstream = generate_bitstring(num_qubits, num_shots, cache=cache) # run quantum circuit to get list of bits
     random_integers = fast_dice_roller(min_val, max_val+1, bitstream, num_its) # run algorithm
     return np.array(random_integers) + diff
 
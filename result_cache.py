@@ -0,0 +1,241 @@
+import os
+import io
+import json
+import hashlib
+import numpy as np
+from qiskit import QuantumCircuit, qpy
+from qiskit.primitives import BitArray
+from qiskit.circuit.library import get_standard_gate_name_mapping
+from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+
+STANDARD_GATES = get_standard_gate_name_mapping()
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.circuit_cache')
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+def circuit_hash(qc: QuantumCircuit):
+    """
+    Content hash of a transpiled circuit, via its QPY serialisation.
+
+    The circuit name is dropped, since Qiskit auto-generates a new one for every circuit.
+
+    Parameters
+    ----------
+    qc : QuantumCircuit, required. The circuit to hash.
+
+    Returns
+    -------
+    str. Hex digest of the circuit content.
+    """
+    buffer = io.BytesIO()
+    qpy.dump(qc.copy(name='circuit'), buffer)
+    return hashlib.sha256(buffer.getvalue()).hexdigest()
+
+
+def structure_hash(qc: QuantumCircuit):
+    """
+    Content hash of an arbitrary circuit, from its instructions.
+
+    QPY output is not reproducible for circuits containing custom gates, which it tags with
+    random uuids and auto-generated definition names, so untranspiled circuits are hashed by
+    walking their instructions instead. Custom composite gates are hashed via their definition.
+
+    Parameters
+    ----------
+    qc : QuantumCircuit, required. The circuit to hash.
+
+    Returns
+    -------
+    str. Hex digest of the circuit content.
+    """
+    hasher = hashlib.sha256()
+
+    def _update(circuit):
+        hasher.update(f'{circuit.num_qubits},{circuit.num_clbits},{circuit.global_phase}'.encode())
+        for inst in circuit.data:
+            op = inst.operation
+            qubits = [circuit.find_bit(q).index for q in inst.qubits]
+            clbits = [circuit.find_bit(c).index for c in inst.clbits]
+            hasher.update(f'{op.name}{qubits}{clbits}{getattr(op, "ctrl_state", None)}'.encode())
+            for param in op.params:
+                hasher.update(np.ascontiguousarray(param).tobytes() if isinstance(param, np.ndarray) else repr(param).encode())
+            if op.name not in STANDARD_GATES and not op.params and op.definition is not None:
+                _update(op.definition)
+
+    _update(qc)
+    return hasher.hexdigest()
+
+
+def target_fingerprint(backend):
+    """
+    Fingerprint of a backend target: its name, instruction set, connectivity and calibration data.
+
+    Parameters
+    ----------
+    backend : BackendV2, required. Backend whose target is fingerprinted.
+
+    Returns
+    -------
+    str. Hex digest of the backend target.
+    """
+    target = backend.target
+    instructions = []
+    for name in sorted(target.operation_names):
+        for qargs, props in sorted(target[name].items(), key=lambda item: item[0] or ()):
+            error = props.error if props is not None else None
+            duration = props.duration if props is not None else None
+            instructions.append([name, qargs, error, duration])
+
+    fingerprint = json.dumps([backend.name, target.num_qubits, instructions], default=str)
+    return hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+def result_key(qc_isa: QuantumCircuit, backend, num_shots: int, options: dict):
+    """
+    Cache key for sampling a transpiled circuit.
+
+    Parallelism options are left out of the key, since they do not change the sampled distribution.
+
+    Parameters
+    ----------
+    qc_isa : QuantumCircuit, required. The transpiled circuit.
+    backend : BackendV2, required. Backend the circuit was transpiled for.
+    num_shots : int, required. Number of shots.
+    options : dict, required. Execution options, e.g. simulator settings or ``{'on_hardware': True}``.
+
+    Returns
+    -------
+    str. Hex digest identifying the execution.
+    """
+    options = {k: v for k, v in options.items() if not k.startswith('max_parallel')}
+    parts = [circuit_hash(qc_isa), target_fingerprint(backend), num_shots, options]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk, content addressed store of transpiled circuits and sampled bit arrays.
+
+    Entries are single files named by their key. Reading an entry refreshes its modification
+    time, and once the store grows beyond ``max_bytes`` the least recently used entries are
+    deleted.
+
+    Parameters
+    ----------
+    path : str, optional. Directory holding the cache. Created if missing.
+    max_bytes : int, optional. Maximum total size of the cache on disk.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, key, extension):
+        return os.path.join(self.path, f'{key}.{extension}')
+
+    def _read(self, key, extension):
+        """ Open an entry for reading and mark it as recently used. Returns None on a miss. """
+        file = self._file(key, extension)
+        # another process may evict the entry at any moment, so a vanished file is just a miss
+        try:
+            os.utime(file)
+            with open(file, 'rb') as f:
+                return io.BytesIO(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key, extension, data: bytes):
+        """ Atomically write an entry, then evict old entries to stay within the size bound. """
+        file = self._file(key, extension)
+        tmp = f'{file}.{os.getpid()}.tmp'  # unique per process, so concurrent writers of one key don't collide
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, file)
+        self.evict()
+
+    def evict(self):
+        """ Delete least recently used entries until the cache fits in ``max_bytes``. """
+        entries = []
+        for name in os.listdir(self.path):
+            # leave in-flight writes from other processes alone
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """ Delete every entry in the cache. """
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+
+    def get_circuit(self, key: str):
+        """ Load a cached circuit, or None if absent. """
+        data = self._read(key, 'qpy')
+        if data is None:
+            return None
+        return qpy.load(data)[0]
+
+    def put_circuit(self, key: str, qc: QuantumCircuit):
+        """ Store a circuit under a key. """
+        buffer = io.BytesIO()
+        qpy.dump(qc, buffer)
+        self._write(key, 'qpy', buffer.getvalue())
+
+    def get_bits(self, key: str):
+        """ Load a cached bit array, or None if absent. """
+        data = self._read(key, 'npz')
+        if data is None:
+            return None
+        with np.load(data) as npz:
+            return BitArray(npz['array'], int(npz['num_bits']))
+
+    def put_bits(self, key: str, bits: BitArray):
+        """ Store the measured bits of a sampler result under a key. """
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, array=bits.array, num_bits=bits.num_bits)
+        self._write(key, 'npz', buffer.getvalue())
+
+
+def cached_transpile(qc: QuantumCircuit, backend, optimization_level: int = 3, cache: ResultCache | None = None):
+    """
+    Transpile a circuit for a backend, reusing a cached transpilation when available.
+
+    Parameters
+    ----------
+    qc : QuantumCircuit, required. The circuit to transpile.
+    backend : BackendV2, required. Backend to target.
+    optimization_level : int, optional. Preset pass manager optimisation level. Default is 3.
+    cache : ResultCache, optional. Cache to read from and write to. If None, always transpile.
+
+    Returns
+    -------
+    QuantumCircuit. The transpiled circuit.
+    """
+    if cache is not None:
+        key = hashlib.sha256(f'{structure_hash(qc)}{target_fingerprint(backend)}{optimization_level}'.encode()).hexdigest()
+        qc_isa = cache.get_circuit(key)
+        if qc_isa is not None:
+            return qc_isa
+
+    pm = generate_preset_pass_manager(target=backend.target, optimization_level=optimization_level)
+    qc_isa = pm.run(qc)
+
+    if cache is not None:
+        cache.put_circuit(key, qc_isa)
+
+    return qc_isa
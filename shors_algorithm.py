@@ -7,13 +7,15 @@ from dotenv import load_dotenv
 from qiskit import *
 from qiskit.visualization import plot_histogram
 from qiskit_aer import *
-from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
 from qiskit_ibm_runtime import (SamplerV2 as Sampler)
 from qiskit.primitives import (BackendSamplerV2)
 from requests.packages import target
 import random
 from qiskit.circuit.library import UnitaryGate
 from qft import *
+from simulator_config import choose_simulator, build_simulator, simulator_circuit
+from result_cache import ResultCache, cached_transpile, result_key
+from histogram import Histogram
 
 def shors_circuit(a, N, num_qubits, num_counting_qubits):
     """
@@ -99,14 +101,11 @@ def find_r(_x, m):
     r = frac.denominator
     return r
 
-def get_period(counts, a, N, num_counting_qubits):
+def get_period(counts: Histogram, a, N, num_counting_qubits):
     """ Get period from set of phase estimations """
 
-    # -- convert measurements to integers __
-    vals = []
-    for bitstring, _ in counts.items():
-        x = int(bitstring, 2)
-        if x != 0: vals.append(x)
+    # -- measured integers, excluding the uninformative 0 phase --
+    vals = counts.outcomes[counts.outcomes != 0].tolist()
 
     # -- get candidate periods --
     r_candidates = [find_r(_x, num_counting_qubits) for _x in vals]
@@ -130,7 +129,8 @@ def get_factors(a, r, N):
 
 import random
 
-def run_shors(N, num_shots: int = 1000, on_hardware: bool = False, a_list: list[int] = []):
+def run_shors(N, num_shots: int = 1000, on_hardware: bool = False, a_list: list[int] = [], noise: bool | None = None,
+              cache: ResultCache | None = None):
     """
     Run Shor's algorithm to factor an integer N.
 
@@ -140,12 +140,14 @@ def run_shors(N, num_shots: int = 1000, on_hardware: bool = False, a_list: list[
     num_shots : int, optional. Measurement shots per circuit execution. Default is 1000.
     on_hardware : bool, optional. If True, run on a quantum device; otherwise use a simulator.
     a_list : list[int], optional. Candidate bases ``a``. If empty, defaults to ``range(2, N)``.
+    noise : bool, optional. Force the simulator noise model on or off. If None, the simulator policy decides.
+    cache : ResultCache, optional. Cache to reuse transpiled circuits and samples from. If None, everything is run afresh.
 
     Returns
     -------
     f1 : int. First factor of N.
     f2 : int. Second factor of N.
-    counts : dict. Measurement counts from the successful order-finding run. Empty if N is prime.
+    counts : Histogram. Measurement counts from the successful order-finding run. Empty if N is prime.
     """
 
     if not a_list: a_list = list(range(2, N)) # generate list of candidate values for a if non supplied
@@ -167,25 +169,39 @@ def run_shors(N, num_shots: int = 1000, on_hardware: bool = False, a_list: list[
             circuit = shors_circuit(a, N, num_qubits, num_counting_qubits)
 
             # Transpile
-            backend_target = backend.target
-            pm = generate_preset_pass_manager(target=backend_target, optimization_level=3)
-            qc_isa = pm.run(circuit)
+            qc_isa = cached_transpile(circuit, backend, optimization_level=3, cache=cache)
 
             if on_hardware:
-                # Run Algorithm on Hardware
-                sampler = Sampler(mode=backend)
-                pubs = [qc_isa]
-                job = sampler.run(pubs, shots=num_shots)
-                res = job.result()
+                options = {'on_hardware': True}
             else:
-                # Run sample on quantum simulator of backend
-                backend_sim = AerSimulator.from_backend(backend)
-                sampler_sim = BackendSamplerV2(backend=backend_sim)
-                job = sampler_sim.run([[qc_isa]], shots=num_shots)
-                res = job.result()
-
-            # # get data in readable format
-            counts = res[0].data.cr.get_counts()
+                # only choose settings here; building the simulator (and its noise model) is left to a cache miss
+                sim_config = choose_simulator(qc_isa, noise=noise)
+                print(sim_config)
+                options = {'noise': sim_config.noise, **sim_config.options}
+
+            # Reuse previous samples of the same circuit, backend and settings
+            key = result_key(qc_isa, backend, num_shots, options) if cache is not None else None
+            bits = cache.get_bits(key) if cache is not None else None
+
+            if bits is None:
+                if on_hardware:
+                    # Run Algorithm on Hardware
+                    sampler = Sampler(mode=backend)
+                    pubs = [qc_isa]
+                    job = sampler.run(pubs, shots=num_shots)
+                    res = job.result()
+                else:
+                    # Run sample on quantum simulator of backend
+                    backend_sim = build_simulator(backend, sim_config)
+                    sampler_sim = BackendSamplerV2(backend=backend_sim)
+                    job = sampler_sim.run([[simulator_circuit(qc_isa, sim_config)]], shots=num_shots)
+                    res = job.result()
+
+                bits = res[0].data.cr
+                if cache is not None: cache.put_bits(key, bits)
+
+            # tally measured phases
+            counts = Histogram.from_bits(bits)
 
             # get period
             period = get_period(counts, a, N, num_counting_qubits)
@@ -199,4 +215,4 @@ def run_shors(N, num_shots: int = 1000, on_hardware: bool = False, a_list: list[
         else: print(f'{a} not coprime to {N}')
 
     print('N has no coprime integers, therefore N is prime')
-    return N, 1, {}
\ No newline at end of file
+    return N, 1, Histogram.empty(num_counting_qubits)
\ No newline at end of file
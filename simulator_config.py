@@ -0,0 +1,341 @@
+import os
+import math
+from dataclasses import dataclass, field
+import numpy as np
+import psutil
+from qiskit import QuantumCircuit
+from qiskit_aer import AerSimulator
+from qiskit_aer.noise import NoiseModel, ReadoutError, depolarizing_error
+
+# gates which map Pauli operators to Pauli operators, and so are simulable by stabilizer methods
+CLIFFORD_GATES = {'id', 'x', 'y', 'z', 'h', 's', 'sdg', 'sx', 'sxdg', 'cx', 'cy', 'cz', 'swap', 'ecr', 'iswap'}
+
+# rotation gates which are Clifford when the angle is a multiple of pi/2
+PHASE_GATES = {'rz', 'p', 'u1'}
+
+# instructions which carry no gate cost
+DIRECTIVES = {'barrier', 'measure', 'reset', 'delay'}
+
+DENSITY_MATRIX_MAX_QUBITS = 10  # noisy circuits up to this width are simulated exactly with one density matrix
+MPS_MAX_BOND_EXPONENT = 20  # largest log2 bond dimension we allow for the matrix_product_state method
+NEAR_CLIFFORD_FRACTION = 0.05  # non-Clifford gate fraction below which extended_stabilizer is preferred
+NEAR_CLIFFORD_MAX_GATES = 40  # extended_stabilizer cost grows exponentially in the non-Clifford count
+DEEP_CIRCUIT_DEPTH = 500  # depth above which gate fusion is switched on regardless of width
+MEMORY_FRACTION = 0.5  # fraction of available memory a single statevector may occupy
+
+
+@dataclass
+class CircuitProfile:
+    """
+    Structural summary of a transpiled circuit, used to choose a simulation method.
+
+    Attributes
+    ----------
+    width : int. Number of qubits acted on by at least one instruction.
+    depth : int. Circuit depth, ignoring barriers.
+    num_gates : int. Number of gates, excluding directives such as barriers and measurements.
+    num_non_clifford : int. Number of gates outside the Clifford group.
+    clifford_fraction : float. Fraction of gates which are Clifford.
+    max_cut_gates : int. Largest number of two-qubit gates crossing any bipartition of the active qubits.
+    bond_exponent : int. Upper bound on log2 of the MPS bond dimension needed to represent the state exactly.
+    """
+    width: int
+    depth: int
+    num_gates: int
+    num_non_clifford: int
+    clifford_fraction: float
+    max_cut_gates: int
+    bond_exponent: int
+
+
+@dataclass
+class SimulatorConfig:
+    """
+    Aer simulator settings chosen for a circuit, together with the reasoning behind them.
+
+    Attributes
+    ----------
+    method : str. Aer simulation method.
+    noise : bool. Whether the backend noise model is applied.
+    options : dict. Options passed to the AerSimulator.
+    profile : CircuitProfile. Structure of the circuit the choice was made for.
+    reasons : list[str]. Human readable justification of each setting.
+    """
+    method: str
+    noise: bool
+    options: dict
+    profile: CircuitProfile
+    reasons: list[str] = field(default_factory=list)
+
+    def __str__(self):
+        lines = [f"Simulator method: {self.method} (noise {'on' if self.noise else 'off'})"]
+        lines += [f"  - {reason}" for reason in self.reasons]
+        return '\n'.join(lines)
+
+
+def is_clifford(instruction):
+    """ Check whether a circuit instruction is a Clifford gate """
+    name = instruction.operation.name
+    if name in CLIFFORD_GATES:
+        return True
+    if name in PHASE_GATES:
+        angle = float(instruction.operation.params[0])
+        return math.isclose(angle / (np.pi / 2), round(angle / (np.pi / 2)), abs_tol=1e-9)
+    return False
+
+
+def profile_circuit(qc: QuantumCircuit):
+    """
+    Measure the width, depth, Clifford content and entanglement structure of a circuit.
+
+    Transpiled circuits are laid out on every qubit of the device, so the width only counts
+    qubits which are actually used. Entanglement is estimated by ordering the active qubits
+    and counting the two-qubit gates crossing each cut, each of which can at most double the
+    Schmidt rank across it.
+
+    Parameters
+    ----------
+    qc : QuantumCircuit, required. The (transpiled) circuit to inspect.
+
+    Returns
+    -------
+    CircuitProfile. Summary of the circuit structure.
+    """
+    active = sorted({qc.find_bit(q).index for inst in qc.data if inst.operation.name != 'barrier' for q in inst.qubits})
+    position = {q: i for i, q in enumerate(active)}
+    width = len(active)
+
+    num_gates = 0
+    num_non_clifford = 0
+    crossings = np.zeros(max(width - 1, 0), dtype=int)
+
+    for inst in qc.data:
+        if inst.operation.name in DIRECTIVES:
+            continue
+        num_gates += 1
+        if not is_clifford(inst):
+            num_non_clifford += 1
+
+        # count gates straddling each cut between neighbouring active qubits
+        if len(inst.qubits) > 1:
+            positions = [position[qc.find_bit(q).index] for q in inst.qubits]
+            crossings[min(positions):max(positions)] += 1
+
+    max_cut_gates = int(crossings.max()) if width > 1 else 0
+
+    # the Schmidt rank across a cut is also bounded by the dimension of the smaller side
+    bond_exponent = 0
+    for cut, gates in enumerate(crossings):
+        bond_exponent = max(bond_exponent, min(int(gates), cut + 1, width - cut - 1))
+
+    return CircuitProfile(
+        width=width,
+        depth=qc.depth(lambda inst: inst.operation.name != 'barrier'),
+        num_gates=num_gates,
+        num_non_clifford=num_non_clifford,
+        clifford_fraction=1.0 - num_non_clifford / num_gates if num_gates else 1.0,
+        max_cut_gates=max_cut_gates,
+        bond_exponent=bond_exponent,
+    )
+
+
+def max_statevector_qubits(bytes_per_amplitude: int):
+    """ Largest statevector that fits in the allowed share of available memory """
+    available = psutil.virtual_memory().available * MEMORY_FRACTION
+    return int(np.log2(available / bytes_per_amplitude))
+
+
+def choose_simulator(qc: QuantumCircuit, noise: bool | None = None, num_cores: int | None = None):
+    """
+    Choose an Aer simulation method and options for a transpiled circuit.
+
+    Parameters
+    ----------
+    qc : QuantumCircuit, required. The transpiled circuit to be simulated.
+    noise : bool, optional. Force the backend noise model on or off. If None, keep noise where the method supports it.
+    num_cores : int, optional. Cores the simulator may use for threads or parallel shots. Default is every core.
+
+    Returns
+    -------
+    SimulatorConfig. The chosen method, options and the reasons for them.
+    """
+    profile = profile_circuit(qc)
+    reasons = []
+    keep_noise = True if noise is None else noise
+    max_double = max_statevector_qubits(16)
+    max_single = max_statevector_qubits(8)
+    precision = 'double'
+
+    # ------ Choose method ------
+    if keep_noise and profile.width <= DENSITY_MATRIX_MAX_QUBITS:
+        method = 'density_matrix'
+        reasons.append(f"{profile.width} active qubits <= {DENSITY_MATRIX_MAX_QUBITS}: noise is simulated exactly in one pass")
+    elif profile.width <= max_double:
+        method = 'statevector'
+        reasons.append(f"{profile.width} active qubits fit a double precision statevector (limit {max_double})")
+    elif profile.width <= max_single:
+        method = 'statevector'
+        precision = 'single'
+        reasons.append(f"{profile.width} active qubits only fit a single precision statevector (limit {max_single})")
+    elif profile.num_non_clifford == 0:
+        method = 'stabilizer'
+        reasons.append(f"{profile.width} active qubits exceed statevector memory; circuit is entirely Clifford")
+        if keep_noise:
+            reasons.append("backend noise approximated by Pauli errors: stabilizer cannot apply thermal relaxation")
+    elif profile.num_non_clifford <= NEAR_CLIFFORD_MAX_GATES and (1 - profile.clifford_fraction) <= NEAR_CLIFFORD_FRACTION:
+        method = 'extended_stabilizer'
+        reasons.append(f"{profile.width} active qubits exceed statevector memory; circuit is {profile.clifford_fraction:.1%} "
+                       f"Clifford with {profile.num_non_clifford} non-Clifford gates")
+        if keep_noise:
+            keep_noise = False
+            reasons.append("noise model disabled: extended_stabilizer does not support general backend noise")
+        reasons.append("rz gates rewritten as p gates, the only form extended_stabilizer accepts for non-Clifford angles")
+    else:
+        method = 'matrix_product_state'
+        reasons.append(f"{profile.width} active qubits exceed statevector memory; "
+                       f"bond dimension bounded by 2^{profile.bond_exponent}")
+        if profile.bond_exponent > MPS_MAX_BOND_EXPONENT:
+            reasons.append(f"warning: bond exponent {profile.bond_exponent} > {MPS_MAX_BOND_EXPONENT}, "
+                           f"simulation may be slow or exhaust memory")
+
+    if noise is False:
+        reasons.append("noise model disabled by caller")
+
+    options = {'method': method}
+    if method in ('statevector', 'density_matrix'):
+        options['precision'] = precision
+
+    # ------ Gate fusion ------
+    # fusion trades a cheap classical matrix product for fewer passes over a large state
+    if method in ('statevector', 'density_matrix'):
+        fusion_threshold = min(14, profile.width) if profile.depth > DEEP_CIRCUIT_DEPTH else 14
+        options['fusion_enable'] = True
+        options['fusion_threshold'] = fusion_threshold
+        reasons.append(f"gate fusion enabled from {fusion_threshold} qubits (depth {profile.depth})")
+
+    # ------ Parallelism ------
+    # noiseless runs and density matrices sample every shot from one final state, so threads
+    # are best spent on the state update. Noisy trajectories repeat the simulation per shot,
+    # which parallelises across shots instead.
+    num_cores = num_cores or os.cpu_count() or 1
+    per_shot = keep_noise and method != 'density_matrix'
+    options['max_parallel_threads'] = num_cores
+    options['max_parallel_shots'] = num_cores if per_shot else 1
+    reasons.append(f"{num_cores} threads, parallelised over {'shots' if per_shot else 'the state update'}")
+
+    return SimulatorConfig(method=method, noise=keep_noise, options=options, profile=profile, reasons=reasons)
+
+
+def pauli_noise_model(backend):
+    """
+    Pauli approximation of a backend's noise, for the stabilizer method.
+
+    Each gate gets a depolarizing error matching its reported error rate, and each qubit a
+    symmetric readout error. Thermal relaxation is dropped, as it is not a Pauli channel.
+
+    Parameters
+    ----------
+    backend : BackendV2, required. Device whose error rates are used.
+
+    Returns
+    -------
+    NoiseModel. The Pauli noise model.
+    """
+    target = backend.target
+    noise_model = NoiseModel(basis_gates=list(target.operation_names))
+
+    for name in target.operation_names:
+        if name in DIRECTIVES:
+            continue
+        for qargs, props in target[name].items():
+            if qargs is None or props is None or not props.error:
+                continue
+            # average gate infidelity r of a depolarizing channel with parameter p is p(d-1)/d
+            dim = 2 ** len(qargs)
+            param = min(props.error * dim / (dim - 1), dim**2 / (dim**2 - 1))
+            noise_model.add_quantum_error(depolarizing_error(param, len(qargs)), name, list(qargs))
+
+    if 'measure' in target.operation_names:
+        for qargs, props in target['measure'].items():
+            if qargs is None or props is None or not props.error:
+                continue
+            noise_model.add_readout_error(ReadoutError([[1 - props.error, props.error], [props.error, 1 - props.error]]), list(qargs))
+
+    return noise_model
+
+
+def build_noise_model(backend, config: SimulatorConfig):
+    """ Noise model matching a simulator config: None if noise is off, Pauli-only for the stabilizer method """
+    if not config.noise:
+        return None
+    if config.method == 'stabilizer':
+        return pauli_noise_model(backend)
+    return NoiseModel.from_backend(backend)
+
+
+def simulator_circuit(qc: QuantumCircuit, config: SimulatorConfig):
+    """
+    Adapt a transpiled circuit to the chosen simulation method.
+
+    Aer's extended_stabilizer method rejects rz gates with non-Clifford angles but accepts the
+    same rotations as p gates, which differ only by a global phase.
+
+    Parameters
+    ----------
+    qc : QuantumCircuit, required. The transpiled circuit.
+    config : SimulatorConfig, required. The chosen simulator settings.
+
+    Returns
+    -------
+    QuantumCircuit. The circuit to pass to the simulator.
+    """
+    if config.method != 'extended_stabilizer':
+        return qc
+
+    adapted = qc.copy_empty_like()
+    for inst in qc.data:
+        if inst.operation.name == 'rz':
+            adapted.p(inst.operation.params[0], inst.qubits[0])
+        else:
+            adapted.append(inst)
+    return adapted
+
+
+def build_simulator(backend, config: SimulatorConfig):
+    """
+    Build an AerSimulator for a chosen config, mirroring a backend.
+
+    Parameters
+    ----------
+    backend : BackendV2, required. Device whose target and noise model are mirrored.
+    config : SimulatorConfig, required. The chosen simulator settings.
+
+    Returns
+    -------
+    AerSimulator. The configured simulator.
+    """
+    # the device target only allows its own basis gates, which excludes the p gates extended_stabilizer needs.
+    # The method always runs noiseless, so nothing from the backend is lost.
+    if config.method == 'extended_stabilizer':
+        return AerSimulator(**config.options)
+
+    return AerSimulator.from_backend(backend, noise_model=build_noise_model(backend, config), **config.options)
+
+
+def configure_simulator(backend, qc: QuantumCircuit, noise: bool | None = None):
+    """
+    Build an AerSimulator mirroring a backend, configured for a particular transpiled circuit.
+
+    Parameters
+    ----------
+    backend : BackendV2, required. Device whose target and noise model are mirrored.
+    qc : QuantumCircuit, required. The transpiled circuit to be simulated.
+    noise : bool, optional. Force the backend noise model on or off. If None, the policy decides.
+
+    Returns
+    -------
+    backend_sim : AerSimulator. The configured simulator.
+    config : SimulatorConfig. The chosen settings and the reasoning behind them.
+    """
+    config = choose_simulator(qc, noise)
+    return build_simulator(backend, config), config